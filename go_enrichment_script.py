@@ -156,8 +156,19 @@ if __name__ == '__main__':
         action="store_true",
         dest="no_part_of",
         help='Ignore part_of relations between GO terms during traversal.')
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        dest='threads',
+        help=
+        'Number of threads used to count gene associations. Defaults to all available cores.'
+    )
     args = parser.parse_args()
 
+    if args.threads is not None and args.threads < 1:
+        parser.error('--threads must be at least 1.')
+
     # Import the gene set of interest (Uniprot AC format)
     interest = genelist_importer.importGeneList(args.subset)
 
@@ -265,7 +276,8 @@ if __name__ == '__main__':
         gafSubset,
         minGenes=args.minGenes,
         threshold=args.testing_limit,
-        propagation=args.propagation)
+        propagation=args.propagation,
+        threads=args.threads)
 
     # Update results with multiple testing correction
     enrichment_stats.multipleTestingCorrection(
@@ -4,13 +4,20 @@
 @author: Pieter Moris
 '''
 
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 # import statsmodels.sandbox.stats.multicomp
-import statsmodels.stats.multitest
 
-from scipy.stats import hypergeom
+from scipy.special import gammaln, logsumexp
+
+# numba is optional, it is used to compile the association counting kernel
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
 # def enrichmentOneSided(GOid, background, subset, GOdict, gafDict, gafSubset, minGenes):
@@ -75,27 +82,123 @@ def enrichmentOneSided(subsetGO, backgroundTotal, backgroundGO, subsetTotal):
     and we want P(k or more), we need to calculate 1 - P(less than k) =  1 - P(k-1 or less)
     sf is the survival function (1-cdf).
 
+    All arguments can also be numpy arrays, in which case all tests are performed at once.
+
     Parameters
     ----------
-    subsetGO : int
+    subsetGO : int or numpy.ndarray
         The number of genes in the interest subset associated with a GO term.
     backgroundTotal : int
         The total number of genes in the background set.
-    backgroundGO : int
+    backgroundGO : int or numpy.ndarray
         The number of genes in the background set associated with the GO term.
     subsetTotal : int
         The total number of genes in the interest subset.
 
     Returns
     -------
-    float
-        The p-value of the one-sided hypergeometric test.
+    float or numpy.ndarray
+        The p-value(s) of the one-sided hypergeometric test.
+    """
+
+    # log(i!) = log(gamma(i + 1))
+    logFactorials = gammaln(np.arange(1, backgroundTotal + 2))
+
+    # Guard against values that exceed one by a rounding error
+    pVal = np.minimum(np.exp(hypergeomLogSF(subsetGO, backgroundTotal, backgroundGO,
+                                            subsetTotal, logFactorials)), 1.0)
+
+    return pVal[()]
+
+
+def hypergeomLogSF(k, M, n, N, logFactorials, maxBlockSize=2 ** 20):
     """
+    Computes the natural logarithm of the probability of drawing k or more successes
+    from a hypergeometric distribution, i.e. log(P(X >= k)).
 
-    pVal = hypergeom.sf(subsetGO - 1, backgroundTotal,
-                        backgroundGO, subsetTotal)
+    The probability mass functions are summed in log space using a precomputed table of
+    log-factorials, which avoids the overhead of scipy.stats and does not underflow for
+    very small tail probabilities. Only the shorter of the two tails is summed: the upper tail
+    from k up to min(n, N) successes, or, if k lies below the mode, the lower tail up to k - 1,
+    which is then subtracted from 1.
+
+    Parameters
+    ----------
+    k : int or numpy.ndarray
+        The (minimum) number of successes.
+    M : int
+        The population size.
+    n : int or numpy.ndarray
+        The number of successes in the population.
+    N : int
+        The number of draws.
+    logFactorials : numpy.ndarray
+        An array containing log(i!) at position i, for i up to (at least) M.
+        E.g. scipy.special.gammaln(numpy.arange(1, M + 2)).
+    maxBlockSize : int
+        The maximum number of probability mass function terms that are evaluated at once.
+
+    Returns
+    -------
+    float or numpy.ndarray
+        The log-probability of k or more successes.
+    """
 
-    return pVal
+    k, n = np.broadcast_arrays(np.asarray(k, dtype=np.int64), np.asarray(n, dtype=np.int64))
+    logSF = np.empty(k.shape, dtype=np.float64)
+    k = k.ravel()
+    n = n.ravel()
+    logSFflat = logSF.reshape(-1)
+
+    # The upper tail runs from k (or the lowest possible number of successes) to the highest possible number
+    lowest = np.maximum(0, N + n - M)
+    highest = np.minimum(n, N)
+    start = np.clip(k, lowest, highest + 1)
+
+    # If k lies below the mode, the upper tail holds most of the probability mass,
+    # so summing the lower tail instead (if shorter) does not lose precision
+    mode = (N + 1) * (n + 1) // (M + 2)
+    lower = (start <= mode) & (start - lowest < highest - start + 1)
+    first = np.where(lower, lowest, start)
+    last = np.where(lower, start - 1, highest)
+
+    # log of the denominator of the pmf: binomial(M, N)
+    logTotal = logFactorials[M] - logFactorials[N] - logFactorials[M - N]
+
+    # Evaluate the tests in blocks to limit the size of the (tests x successes) grid.
+    # The tests are sorted by the length of their sum and grouped in classes of up to twice the
+    # shortest length, so that the padding of each block stays small.
+    width = np.maximum(last - first + 1, 1)
+    order = np.argsort(width, kind='stable')
+    widthClass = np.frexp(width[order] - 1)[1]
+
+    for classOrder in np.split(order, np.flatnonzero(np.diff(widthClass)) + 1):
+        classWidth = int(width[classOrder].max(initial=1))
+        blockSize = max(maxBlockSize // classWidth, 1)
+
+        for blockStart in range(0, len(classOrder), blockSize):
+            block = classOrder[blockStart:blockStart + blockSize]
+            nBlock = n[block, None]
+            i = first[block, None] + np.arange(classWidth)
+            valid = i <= last[block, None]
+            # Clip the indices of out-of-range terms to the support, they are masked afterwards
+            i = np.clip(i, lowest[block, None], highest[block, None])
+
+            logPmf = (logFactorials[nBlock] - logFactorials[i] - logFactorials[nBlock - i]
+                      + logFactorials[M - nBlock] - logFactorials[N - i] - logFactorials[M - nBlock - N + i]
+                      - logTotal)
+            logPmf[~valid] = -np.inf
+
+            logSFflat[block] = logsumexp(logPmf, axis=1)
+
+    # log(1 - P(X < k)) for the tests whose lower tail was summed,
+    # an empty lower tail (k at most the lowest possible number of successes) gives probability 1
+    logSFflat[lower] = np.log1p(-np.minimum(np.exp(logSFflat[lower]), 1.0))
+
+    # An empty sum (k larger than the highest possible number of successes) has probability 0
+    logSFflat[~lower & (first > last)] = -np.inf
+
+    return logSF[()]
 
 
 def countGOassociations(validTerms, gafDict):
@@ -115,6 +218,10 @@ def countGOassociations(validTerms, gafDict):
          The number of associated genes.
      """
 
+    # Both operands of isdisjoint() should be sets,
+    # so that CPython can iterate over the smaller one and probe the larger one
+    validTerms = frozenset(validTerms)
+
     GOcounter = 0
 
     # For each gene:GO id set pair in the GAF dictionary
@@ -128,8 +235,157 @@ def countGOassociations(validTerms, gafDict):
     return GOcounter
 
 
+def buildAnnotationBitmap(gafDict, termIndex):
+    """
+    Builds an inverted index that maps each GO term to a bitmask over the genes of a gaf dictionary.
+
+    Each row of the resulting matrix corresponds to a GO term (as defined by termIndex) and
+    each bit in that row to a gene (in the iteration order of gafDict). A bit is set if the
+    gene is associated with the GO term.
+
+    Parameters
+    ----------
+    gafDict : dict
+        A dictionary that maps Uniprot ACs to GO IDs.
+    termIndex : dict
+        A dictionary that maps GO IDs to row indices of the bitmap.
+        Terms that are absent from this dictionary are ignored.
+
+    Returns
+    -------
+    numpy.ndarray
+        A 2D array of type uint64 with one row per GO term and one bit per gene.
+    """
+
+    bitmap = np.zeros((len(termIndex), (len(gafDict) + 63) // 64), dtype=np.uint64)
+
+    # Collect the (term, gene) coordinates of every association
+    rows = []
+    genes = []
+    for geneIndex, GOids in enumerate(gafDict.values()):
+        for GOid in GOids:
+            if GOid in termIndex:
+                rows.append(termIndex[GOid])
+                genes.append(geneIndex)
+
+    rows = np.array(rows, dtype=np.intp)
+    genes = np.array(genes, dtype=np.uint64)
+
+    # Set the bit of each gene in the word it belongs to,
+    # bitwise_or.at is required because multiple genes can share a word
+    np.bitwise_or.at(bitmap, (rows, (genes // 64).astype(np.intp)),
+                     np.left_shift(np.uint64(1), genes % np.uint64(64)))
+
+    return bitmap
+
+
+def annotatedTermRows(validTerms, termIndex):
+    """
+    Retrieves the bitmap rows of those GO terms that are annotated to at least one gene.
+
+    Only the smaller of the two collections is iterated over: for general terms the set of
+    (recursive) children can be much larger than the number of annotated terms, whereas
+    specific terms only have a handful of children.
+
+    Parameters
+    ----------
+    validTerms : set
+        A set of GO terms. Should include the GO id of interest and all of its children.
+    termIndex : dict
+        A dictionary that maps the annotated GO IDs to their row in the bitmaps.
+
+    Returns
+    -------
+    numpy.ndarray
+        The bitmap row indices of the annotated valid terms.
+    """
+
+    if len(validTerms) <= len(termIndex):
+        rows = (termIndex[term] for term in validTerms if term in termIndex)
+    else:
+        rows = (row for term, row in termIndex.items() if term in validTerms)
+
+    return np.fromiter(rows, dtype=np.intp)
+
+
+def countGOassociationsBatch(indptr, termRows, bitmap, maxWords=2 ** 22):
+    """
+    Counts the number of genes associated with at least one of the provided GO terms,
+    for a batch of GO term sets, using vectorized OR reductions.
+
+    The bitmap rows of consecutive sets are gathered and combined with a single
+    numpy.bitwise_or.reduceat() call, in blocks of at most maxWords gathered words.
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray
+        An int64 array of length (number of sets + 1), the bitmap rows of the i-th set
+        are stored in termRows[indptr[i]:indptr[i + 1]].
+    termRows : numpy.ndarray
+        The concatenated bitmap row indices of all sets.
+    bitmap : numpy.ndarray
+        A bitmap generated by buildAnnotationBitmap().
+    maxWords : int
+        The maximum number of bitmap words that are gathered at once.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of associated genes for each set.
+    """
+
+    counts = np.zeros(len(indptr) - 1, dtype=np.int64)
+
+    # Empty sets have no associated genes and cannot be passed to reduceat(),
+    # dropping them does not change the boundaries of the remaining sets
+    nonEmpty = np.flatnonzero(indptr[1:] > indptr[:-1])
+    maxRows = max(maxWords // max(bitmap.shape[1], 1), 1)
+
+    blockStart = 0
+    while blockStart < len(nonEmpty):
+        # Extend the block with sets until the number of gathered rows exceeds the limit
+        firstRow = indptr[nonEmpty[blockStart]]
+        blockStop = max(int(np.searchsorted(indptr[nonEmpty + 1], firstRow + maxRows, side='right')),
+                        blockStart + 1)
+        block = nonEmpty[blockStart:blockStop]
+
+        rows = bitmap[termRows[firstRow:indptr[block[-1] + 1]]]
+        geneMasks = np.bitwise_or.reduceat(rows, indptr[block] - firstRow, axis=0)
+        counts[block] = popcount(geneMasks, axis=1)
+
+        blockStart = blockStop
+
+    return counts
+
+
+def popcount(words, axis=None):
+    """
+    Counts the number of set bits in an array of uint64 words.
+
+    Parameters
+    ----------
+    words : numpy.ndarray
+        An array of type uint64.
+    axis : int
+        The axis along which the bits are counted. By default, all bits are counted.
+
+    Returns
+    -------
+    int or numpy.ndarray
+        The number of set bits.
+    """
+
+    # numpy >= 2.0 offers a popcount ufunc that uses the hardware instruction,
+    # older versions have to unpack the words into separate bits
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=axis, dtype=np.int64)
+
+    bits = np.unpackbits(words.view(np.uint8), axis=-1)
+    return bits.sum(axis=axis, dtype=np.int64)
+
+
 def enrichmentAnalysis(GOdict, gafDict, gafSubset,
-                       minGenes=3, threshold=0.05, propagation=True):
+                       minGenes=3, threshold=0.05, propagation=True, threads=None):
     """
     Performs a GO enrichment analysis.
 
@@ -138,9 +394,9 @@ def enrichmentAnalysis(GOdict, gafDict, gafSubset,
     one-sided hypergeometric test.
 
     If the test is not significant at the chosen threshold (default = 0.05),
-    the test will recursively be performed for all of the GO term's parents.
+    the test will subsequently be performed for all of the GO term's parents.
     NOTE: these p-values *are* counted for multiple testing correction.
-    If the test is significant, the recursive call will stop the propagation.
+    If the test is significant, the propagation stops for this branch.
 
     NOTE: At the moment, this means the test will be propagated until the top level,
     but after a certain point it might not be worth testing anymore (e.g. "biological process").
@@ -154,8 +410,8 @@ def enrichmentAnalysis(GOdict, gafDict, gafSubset,
     by counting the number of genes associated with the GO term itself or
     with any of its child terms.
 
-    In the end, a dictionary containing the tested GO IDs mapped to p-values is returned.
-    Any term that was not tested will be absent.
+    In the end, a dictionary containing parallel arrays of the tested GO IDs, their p-values
+    and frequency counts is returned. Any term that was not tested will be absent.
 
     Parameters
     ----------
@@ -174,12 +430,15 @@ def enrichmentAnalysis(GOdict, gafDict, gafSubset,
         parents will not be further recursively tested for enrichment.
     propagation : boolean
         Specifies whether or not tests should propagate upwards through the tree.
+    threads : int
+        The number of threads used to count the gene associations of the GO terms.
+        Defaults to all available cores.
 
     Returns
     -------
-    dict of dicts
-        A dictionary of dictionaries mapping GO IDs to p-values and frequencies.
-        Only GO IDs that were tested are returned.
+    dict of numpy.ndarray
+        A dictionary of parallel arrays with the keys `GOids`, `pValues`, `interestCount`
+        and `backgroundCount`. Only GO IDs that were tested are returned.
     """
 
     # Generate a list of all base GO terms to test
@@ -198,8 +457,9 @@ def enrichmentAnalysis(GOdict, gafDict, gafSubset,
     # If we fail to remove it, more tests than necessary will be conducted. This will take longer, but not affect
     # multiple testing correction in any way (since a repeatedly tested term will just overwrite its value).
 
-    subsetGOids = {GOid for gene, GOids in gafSubset.items() for GOid in GOids}
-    subsetGOidsParents = {parent for GOid in subsetGOids for parent in GOdict[GOid].recursive_parents}
+    # set.union() combines the sets in C, instead of adding every element in a Python-level loop
+    subsetGOids = set().union(*gafSubset.values())
+    subsetGOidsParents = set().union(*[GOdict[GOid].recursive_parents for GOid in subsetGOids])
     baseGOids = [GOid for GOid in subsetGOids if GOid not in subsetGOidsParents]
 
     # Deprecated code with unintended effect!
@@ -217,140 +477,383 @@ def enrichmentAnalysis(GOdict, gafDict, gafSubset,
     #         if not GOdict[GOid].children:
     #             baseGOids.append(GOid)
 
-    # Create dictionary of dictionaries to store the hypergeometric p-values and frequency counts
-    enrichmentTestResults = {'pValues': {}, 'interestCount': {},
-                             'backgroundCount': {}}
-
     backgroundTotal = len(gafDict)
     subsetTotal = len(gafSubset)
 
-    # Perform a onesided enrichment test for each of the GO ids
+    # Assign an integer index to every GO id, all per-term data is stored in arrays indexed by it.
+    indexedGOids = list(GOdict)
+    GOindex = {GOid: i for i, GOid in enumerate(indexedGOids)}
+    parentIndptr, parentIndices = buildParentCSR(indexedGOids, GOdict, GOindex)
 
-    # if propagation is disabled, check explicit terms in subsetGOids.
+    # Collect every term that might be tested: the explicit terms when propagation is disabled,
+    # or the base terms and all of their ancestors when propagation is enabled (default).
     if not propagation:
-        for GOid in subsetGOids:
-            # NOTE: recursiveTester will actually skip recursive steps if propagation=False, despite its name.
-            recursiveTester(GOid, backgroundTotal, subsetTotal, GOdict,
-                            gafDict, gafSubset, minGenes, threshold, enrichmentTestResults, propagation)
-
-    # if propagation is enabled (default), use baseGOids to avoid redundant tests
+        candidateGOids = list(subsetGOids)
     else:
-        # and recurse to parents if tests are not significant at chosen threshold
-        for GOid in baseGOids:
-            recursiveTester(GOid, backgroundTotal, subsetTotal, GOdict,
-                            gafDict, gafSubset, minGenes, threshold, enrichmentTestResults, propagation)
+        baseGOidsParents = set().union(*[GOdict[GOid].recursive_parents for GOid in baseGOids])
+        candidateGOids = baseGOids + list(baseGOidsParents.difference(baseGOids))
+    candidateIndices = np.array([GOindex[GOid] for GOid in candidateGOids], dtype=np.int64)
+
+    # Only genes that are associated with at least one term under a candidate term can contribute to the counts,
+    # so the other genes are left out of the bitmaps (but they still count towards the totals).
+    relevantTerms = collectRelevantTerms(candidateGOids, GOdict)
+    relevantGafDict = {gene: GOids for gene, GOids in gafDict.items() if not relevantTerms.isdisjoint(GOids)}
+    relevantGafSubset = {gene: GOids for gene, GOids in gafSubset.items() if not relevantTerms.isdisjoint(GOids)}
+
+    # Create an inverted index of the background and interest gaf dictionaries,
+    # mapping each relevant annotated GO term to a bitmask of its associated genes.
+    termIndex = {}
+    for GOids in list(relevantGafDict.values()) + list(relevantGafSubset.values()):
+        for GOid in GOids:
+            if GOid in relevantTerms:
+                termIndex.setdefault(GOid, len(termIndex))
+    backgroundBitmap = buildAnnotationBitmap(relevantGafDict, termIndex)
+    subsetBitmap = buildAnnotationBitmap(relevantGafSubset, termIndex)
+
+    # Count the background and interest genes of every candidate term once. Terms that are skipped
+    # because of a low gene count can be reached again via each of their descendants.
+    backgroundCounts = np.zeros(len(indexedGOids), dtype=np.int64)
+    subsetCounts = np.zeros(len(indexedGOids), dtype=np.int64)
+    backgroundCounts[candidateIndices], subsetCounts[candidateIndices] = countCandidateAssociations(
+        candidateGOids, GOdict, termIndex, backgroundBitmap, subsetBitmap, threads)
+
+    # Perform the onesided enrichment tests based on the precomputed counts,
+    # only the terms that are actually reached are tested
+
+    # if propagation is disabled, check explicit terms in subsetGOids,
+    # otherwise (default) start from baseGOids to avoid redundant tests
+    # and move up to parents if tests are not significant at chosen threshold
+    startIndices = candidateIndices if not propagation else candidateIndices[:len(baseGOids)]
+    tested, pValues = propagateTests(startIndices, parentIndptr, parentIndices, backgroundCounts, subsetCounts,
+                                     backgroundTotal, subsetTotal, minGenes, threshold, propagation)
+
+    # Store the hypergeometric p-values and frequency counts of the tested terms as parallel arrays
+    enrichmentTestResults = {'GOids': np.array(indexedGOids, dtype=object)[tested],
+                             'pValues': pValues[tested],
+                             'interestCount': subsetCounts[tested],
+                             'backgroundCount': backgroundCounts[tested]}
 
     print('Tested', len(enrichmentTestResults['pValues']), 'GO categories for enrichment.\n')
-    sig = sum(i < threshold for i in enrichmentTestResults['pValues'].values())
+    sig = np.sum(enrichmentTestResults['pValues'] < threshold)
     print(sig, 'were significant at (uncorrected) alpha =', threshold, '\n')
 
     return enrichmentTestResults
 
 
-def recursiveTester(GOid, backgroundTotal, subsetTotal, GOdict, gafDict,
-                    gafSubset, minGenes, threshold, enrichmentTestResults, propagation):
+def collectRelevantTerms(candidateGOids, GOdict):
     """
-    Implements the recursive enrichment tests for the enrichmentAnalysis() function
-    by propagating through parent terms in case of an insignificant result or low
-    gene count.
+    Collects all GO terms that count towards at least one of the candidate terms,
+    i.e. the union of the candidate terms and their (recursive) child terms.
+
+    Since the valid terms of a GO term include those of all of its descendants, only the candidates
+    without an ancestor among the other candidates need to be combined.
+
+    Parameters
+    ----------
+    candidateGOids : list of str
+        The GO term ids that might be tested.
+    GOdict : dict
+        A dictionary of GO objects generated by importOBO().
+        Keys are of the format `GO-0000001` and map to OBO objects.
+
+    Returns
+    -------
+    frozenset of str
+        The GO ids that count towards any of the candidate terms.
+    """
+
+    candidateSet = frozenset(candidateGOids)
+    topGOids = [GOid for GOid in candidateSet if candidateSet.isdisjoint(GOdict[GOid].recursive_parents)]
+
+    return frozenset().union(*(getValidTerms(GOid, GOdict) for GOid in topGOids))
+
+
+def buildParentCSR(GOids, GOdict, GOindex):
+    """
+    Stores the immediate parents of every GO term as integer indices in a compressed sparse row layout,
+    i.e. the parents of the i-th GO term are parentIndices[parentIndptr[i]:parentIndptr[i + 1]].
+
+    Parents that are absent from the GO dictionary (e.g. because of namespace filtering) are skipped.
+
+    Parameters
+    ----------
+    GOids : list of str
+        The GO ids in the order of their integer index.
+    GOdict : dict
+        A dictionary of GO objects generated by importOBO().
+        Keys are of the format `GO-0000001` and map to OBO objects.
+    GOindex : dict
+        A dictionary that maps each GO id to its integer index.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The index pointer and parent index arrays.
+    """
+
+    parentLists = [[GOindex[parent] for parent in GOdict[GOid].parents if parent in GOindex] for GOid in GOids]
+
+    parentIndptr = np.zeros(len(parentLists) + 1, dtype=np.int64)
+    np.cumsum([len(parents) for parents in parentLists], out=parentIndptr[1:])
+    parentIndices = np.fromiter((parent for parents in parentLists for parent in parents),
+                                dtype=np.int64, count=parentIndptr[-1])
+
+    return parentIndptr, parentIndices
+
+
+def getValidTerms(GOid, GOdict):
+    """
+    Retrieves the set of terms that count towards a GO term, i.e. the term itself and all of its
+    (recursive) child terms.
+
+    The set is computed once and stored on the GO object, since the hierarchy does not change
+    after buildGOtree() has been run.
 
     Parameters
     ----------
     GOid : str
-        The GO term id that is being tested for enrichment.
-    backgroundTotal : int
-        The total number of genes in the background set.
-    subsetTotal : int
-        The total number of genes in the subset of interest.
+        A GO term id.
     GOdict : dict
         A dictionary of GO objects generated by importOBO().
         Keys are of the format `GO-0000001` and map to OBO objects.
-    gafDict : dict
-        A dictionary mapping the background's gene Uniprot AC's to GO IDs.
-    gafSubset : dict
-        A dictionary that maps the subset's Uniprot ACs to GO IDs.
+
+    Returns
+    -------
+    frozenset of str
+        The GO id and all of its recursive children.
+    """
+
+    GOobj = GOdict[GOid]
+
+    if GOobj.valid_terms is None:
+        GOobj.valid_terms = frozenset(GOobj.recursive_children).union([GOid])
+
+    return GOobj.valid_terms
+
+
+def countCandidateAssociations(candidateGOids, GOdict, termIndex, backgroundBitmap, subsetBitmap, threads=None):
+    """
+    Counts the number of genes in the background and interest set that are associated with each
+    of the provided GO terms or with any of their (recursive) child terms.
+
+    The annotated valid terms of all GO terms are gathered in a compressed sparse row layout,
+    i.e. the bitmap rows of the i-th GO term are stored in termRows[indptr[i]:indptr[i + 1]],
+    so that all counts can be computed by countGOassociationsCSR() in one go.
+
+    Parameters
+    ----------
+    candidateGOids : list of str
+        The GO term ids whose associations are counted.
+    GOdict : dict
+        A dictionary of GO objects generated by importOBO().
+        Keys are of the format `GO-0000001` and map to OBO objects.
+    termIndex : dict
+        A dictionary that maps the annotated GO IDs to their row in the bitmaps.
+    backgroundBitmap : numpy.ndarray
+        A bitmap of the background's gene associations, generated by buildAnnotationBitmap().
+    subsetBitmap : numpy.ndarray
+        A bitmap of the subset's gene associations, generated by buildAnnotationBitmap().
+    threads : int
+        The number of threads used to count the associations. Defaults to all available cores.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The number of associated genes in the background and in the interest set, for each GO term.
+    """
+
+    # While testing for a term, also count all of its (recursive) child terms,
+    # only annotated terms are present in the bitmaps
+    termRowsList = [annotatedTermRows(getValidTerms(GOid, GOdict), termIndex) for GOid in candidateGOids]
+
+    indptr = np.zeros(len(termRowsList) + 1, dtype=np.int64)
+    np.cumsum([len(termRows) for termRows in termRowsList], out=indptr[1:])
+    termRows = np.concatenate(termRowsList) if termRowsList else np.zeros(0, dtype=np.intp)
+
+    # Count the number of genes in the background and subset that were
+    # associated with the current terms
+    backgroundCounts = countGOassociationsCSR(indptr, termRows, backgroundBitmap, threads)
+    subsetCounts = countGOassociationsCSR(indptr, termRows, subsetBitmap, threads)
+
+    return backgroundCounts, subsetCounts
+
+
+def countGOassociationsCSR(indptr, termRows, bitmap, threads=None):
+    """
+    Counts the number of genes associated with at least one of the provided GO terms,
+    for a batch of GO term sets.
+
+    The sets are processed in parallel, either by a compiled numba kernel if numba is installed,
+    or by a pool of threads running countGOassociationsBatch() otherwise (numpy releases the GIL
+    while combining the bitmap rows).
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray
+        An int64 array of length (number of sets + 1), the bitmap rows of the i-th set
+        are stored in termRows[indptr[i]:indptr[i + 1]].
+    termRows : numpy.ndarray
+        The concatenated bitmap row indices of all sets.
+    bitmap : numpy.ndarray
+        A bitmap generated by buildAnnotationBitmap().
+    threads : int
+        The number of threads to use. Defaults to all available cores.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of associated genes for each set.
+    """
+
+    # Use at least one thread, and all available cores if no number was given
+    if threads is not None:
+        threads = max(threads, 1)
+
+    if numba is not None:
+        # The numba thread count is process-wide, so it is set for this call only
+        previousThreads = numba.get_num_threads()
+        numba.set_num_threads(min(threads or numba.config.NUMBA_NUM_THREADS, numba.config.NUMBA_NUM_THREADS))
+        try:
+            return _countGOassociationsKernel(bitmap, indptr, termRows)
+        finally:
+            numba.set_num_threads(previousThreads)
+
+    # Divide the sets into one contiguous chunk per thread
+    threads = threads or os.cpu_count() or 1
+    bounds = np.linspace(0, len(indptr) - 1, min(threads, len(indptr) - 1) + 1).astype(np.int64)
+
+    def countChunk(chunkStart, chunkStop):
+        return countGOassociationsBatch(indptr[chunkStart:chunkStop + 1] - indptr[chunkStart],
+                                        termRows[indptr[chunkStart]:indptr[chunkStop]], bitmap)
+
+    with ThreadPoolExecutor(max_workers=max(len(bounds) - 1, 1)) as executor:
+        chunks = list(executor.map(countChunk, bounds[:-1], bounds[1:]))
+
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _popcount(word):
+        # Count the set bits of a 64-bit word (SWAR algorithm)
+        word = word - ((word >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        word = (word & np.uint64(0x3333333333333333)) + ((word >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        word = (word + (word >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+        return (word * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+    @numba.njit(parallel=True, cache=True)
+    def _countGOassociationsKernel(bitmap, indptr, termRows):
+        counts = np.zeros(len(indptr) - 1, dtype=np.int64)
+        for i in numba.prange(len(indptr) - 1):
+            # Combine the bitmap rows one at a time, so each row is read contiguously
+            geneMask = np.zeros(bitmap.shape[1], dtype=np.uint64)
+            for j in range(indptr[i], indptr[i + 1]):
+                row = bitmap[termRows[j]]
+                for word in range(bitmap.shape[1]):
+                    geneMask[word] |= row[word]
+            total = np.int64(0)
+            for word in range(bitmap.shape[1]):
+                total += np.int64(_popcount(geneMask[word]))
+            counts[i] = total
+        return counts
+
+
+def propagateTests(startIndices, parentIndptr, parentIndices, backgroundCounts, subsetCounts,
+                   backgroundTotal, subsetTotal, minGenes, threshold, propagation):
+    """
+    Implements the propagating enrichment tests for the enrichmentAnalysis() function
+    by moving up to the parent terms in case of an insignificant result or low
+    gene count.
+
+    The GO hierarchy is traversed breadth-first one level (frontier) at a time, so deep hierarchies
+    cannot exceed the recursion limit. Every term is visited at most once.
+
+    The gene counts are computed beforehand for all terms that can be reached, the p-values are
+    only computed for the terms that are tested, in a single vectorized call per level.
+    All GO terms are referred to by the integer index assigned in enrichmentAnalysis().
+
+    Parameters
+    ----------
+    startIndices : numpy.ndarray
+        The indices of the GO terms from which the tests start.
+    parentIndptr : numpy.ndarray
+        The index pointer array of the parents, generated by buildParentCSR().
+    parentIndices : numpy.ndarray
+        The parent index array, generated by buildParentCSR().
+    backgroundCounts : numpy.ndarray
+        The number of background genes associated with each GO term.
+    subsetCounts : numpy.ndarray
+        The number of interest genes associated with each GO term.
+    backgroundTotal : int
+        The total number of genes in the background set.
+    subsetTotal : int
+        The total number of genes in the interest subset.
     minGenes : int
         The minimum number of genes that has to be associated with
     threshold: float
         The threshold of the hypergeometric test for which the GO term's
-        parents will not be further recursively tested for enrichment.
-    enrichmentTestResults : dict of dicts
-        An dictionary of dictionaries that gets passed through the recursion and
-        filled with mappings of GO ids to p-values and frequencies for every enrichment test.
+        parents will not be further tested for enrichment.
     propagation : boolean
         Specifies whether or not tests should propagate upwards through the tree.
 
     Returns
     -------
-    Does not return anything, but fills in the passed pValues dictionary (which is nested
-    in the enrichmentTestResults dictionary).
+    tuple of numpy.ndarray
+        A boolean array indicating which GO terms were tested and an array with the p-value
+        of each tested GO term (NaN for the others).
     """
 
-    # If a certain GOid already has a p-value stored,
-    # it can be skipped and so can its parents
-    if GOid not in enrichmentTestResults['pValues']:
+    tested = np.zeros(len(backgroundCounts), dtype=bool)
+    pValues = np.full(len(backgroundCounts), np.nan)
 
-        # While testing for a term, also count all of its (recursive) child terms
-        validTerms = set([GOid])  # https://stackoverflow.com/questions/36674083/why-is-it-possible-to-replace-set-with
-        validTerms.update(GOdict[GOid].recursive_children)
+    if not propagation:
+        tested[startIndices] = True
+        pValues[tested] = enrichmentOneSided(subsetCounts[tested], backgroundTotal,
+                                             backgroundCounts[tested], subsetTotal)
+        return tested, pValues
 
-        # Count the number of genes in the background and subset that were
-        # associated with the current terms
-        backgroundGO = countGOassociations(validTerms, gafDict)
-        subsetGO = countGOassociations(validTerms, gafSubset)
+    visited = np.zeros(len(backgroundCounts), dtype=bool)
+    frontier = np.unique(startIndices)
 
-        # if GOid == 'GO:0032993':
-        #     print('bg Count', backgroundGO, 'interestCount', subsetGO, 'pval', pVal)
-        #     print('bgTotal', backgroundTotal, 'subsetTotal', subsetTotal)
+    while len(frontier):
+        visited[frontier] = True
 
-        if not propagation:
-            pVal = enrichmentOneSided(
-            subsetGO, backgroundTotal, backgroundGO, subsetTotal)
-            enrichmentTestResults['pValues'][GOid] = pVal
-            enrichmentTestResults['interestCount'][GOid] = subsetGO
-            enrichmentTestResults['backgroundCount'][GOid] = backgroundGO
+        # If the number of associated genes for a GO category is too low,
+        # skip it and move up hierarchy to test the parents
+        lowCount = backgroundCounts[frontier] < minGenes
+        testIndices = frontier[~lowCount]
+        tested[testIndices] = True
+        pValues[testIndices] = enrichmentOneSided(subsetCounts[testIndices], backgroundTotal,
+                                                  backgroundCounts[testIndices], subsetTotal)
 
-            return
+        # If a test is not significant, move up the hierarchy to perform
+        # additional tests on parent terms,
+        # otherwise don't perform any higher up tests
+        propagating = np.concatenate((frontier[lowCount], testIndices[pValues[testIndices] > threshold]))
 
-        else:
-            # If the number of associated genes for the current GO category is too low,
-            # skip and move up hierarchy to test the parents
-            if backgroundGO < minGenes:
-                for parent in GOdict[GOid].parents:
-                    recursiveTester(parent, backgroundTotal, subsetTotal,
-                                    GOdict, gafDict, gafSubset, minGenes,
-                                    threshold, enrichmentTestResults, propagation)
-
-            else:
-                # Map GOid to p-value and the number of associated genes in the interest and background set
-                pVal = enrichmentOneSided(
-                    subsetGO, backgroundTotal, backgroundGO, subsetTotal)
-                enrichmentTestResults['pValues'][GOid] = pVal
-                enrichmentTestResults['interestCount'][GOid] = subsetGO
-                enrichmentTestResults['backgroundCount'][GOid] = backgroundGO
-
-                # If test is not significant, move up the hierarchy to perform
-                # additional tests on parent terms
-                if pVal > threshold:
-                    for parent in GOdict[GOid].parents:
-                        recursiveTester(parent, backgroundTotal, subsetTotal,
-                                        GOdict, gafDict, gafSubset, minGenes,
-                                        threshold, enrichmentTestResults, propagation)
-
-                # Otherwise stop recursion and don't perform any higher up tests
-                else:
-                    return
+        # Gather the parents of the propagating terms from the CSR arrays
+        numParents = parentIndptr[propagating + 1] - parentIndptr[propagating]
+        parentPositions = (np.repeat(parentIndptr[propagating] - np.cumsum(numParents) + numParents, numParents)
+                           + np.arange(numParents.sum()))
+        parents = parentIndices[parentPositions]
+
+        # If a certain GO term was already visited,
+        # it can be skipped and so can its parents
+        frontier = np.unique(parents[~visited[parents]])
+
+    return tested, pValues
 
 
 def multipleTestingCorrection(enrichmentTestResults, testType='fdr_bh', threshold=0.05):
     """
-    Updates the original enrichmentTestResults dictionary of dictionaries by appending
-    an additional dictionary mapping GO ids to corrected p-values.
+    Updates the original enrichmentTestResults dictionary by appending
+    an additional array of corrected p-values.
 
     Parameters
     ----------
-    enrichmentTestResults : dict of dicts
-        An dictionary of dictionaries mapping GO ids to p-values and counts.
+    enrichmentTestResults : dict of numpy.ndarray
+        A dictionary of parallel arrays containing GO ids, p-values and counts,
+        generated by enrichmentAnalysis().
     testType : str
         Specifies the type of multiple correction.
         Options include: `bonferroni` and `fdr_bh` (Benjamini Hochberg)
@@ -365,9 +868,7 @@ def multipleTestingCorrection(enrichmentTestResults, testType='fdr_bh', threshol
         Modifies the provided enrichmenTestResults dictionary in-place.
     """
 
-    # Convert Uniprot AC's and associated p-values to np arrays
-    pValues = enrichmentTestResults['pValues'].values()
-    terms = enrichmentTestResults['pValues'].keys()
+    pValues = enrichmentTestResults['pValues']
 
     # Perform multiple testing correction
     if testType == 'bonferroni':
@@ -379,7 +880,15 @@ def multipleTestingCorrection(enrichmentTestResults, testType='fdr_bh', threshol
 
     print(f'Performing multiple testing correction using the {method_str} method...\n')
     try:
-        corr = statsmodels.stats.multitest.multipletests(list(pValues), alpha=threshold, method=testType)
+        # The two default methods are implemented directly on the p-value array,
+        # statsmodels is only imported for the other methods
+        if testType == 'fdr_bh':
+            corr = fdrCorrection(pValues, threshold)
+        elif testType == 'bonferroni':
+            corr = bonferroniCorrection(pValues, threshold)
+        else:
+            import statsmodels.stats.multitest
+            corr = statsmodels.stats.multitest.multipletests(pValues, alpha=threshold, method=testType)
     except ValueError:
         print('ERROR: Invalid method for multiple testing correction. Accepted options include: fdr_bh, bonferroni and any others defined by statsmodels.stats.multitest.multipletests().')
         sys.exit(1)
@@ -395,21 +904,111 @@ def multipleTestingCorrection(enrichmentTestResults, testType='fdr_bh', threshol
     #     print(np.sum(corr[0]), 'GO terms out of', len(corr[0]),
     #           'were significant after FDR multiple testing correction.')
 
-    # Append corrected p-values as a new dictionary
-    enrichmentTestResults['corr'] = {term: corrValue for term, corrValue in zip(terms, corr[1])}
+    # Append corrected p-values as a new array
+    enrichmentTestResults['corr'] = corr[1]
 
     return None
 
 
+def fdrCorrection(pValues, alpha):
+    """
+    Performs the Benjamini-Hochberg false discovery rate correction.
+
+    Equivalent to statsmodels.stats.multitest.multipletests(method='fdr_bh').
+
+    Parameters
+    ----------
+    pValues : numpy.ndarray
+        The uncorrected p-values.
+    alpha : float
+        The false discovery rate.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        A boolean array indicating which hypotheses are rejected and an array of corrected p-values.
+    """
+
+    numTests = len(pValues)
+    order = np.argsort(pValues)
+    sortedPValues = pValues[order]
+    ecdfFactor = np.arange(1, numTests + 1) / numTests
+
+    # Reject all hypotheses up to the largest rank whose p-value lies below its critical value
+    reject = np.zeros(numTests, dtype=bool)
+    below = np.flatnonzero(sortedPValues <= ecdfFactor * alpha)
+    if len(below):
+        reject[order[:below[-1] + 1]] = True
+
+    # Enforce monotonicity, starting from the largest p-value
+    corrected = np.minimum.accumulate((sortedPValues / ecdfFactor)[::-1])[::-1]
+    corrected = np.minimum(corrected, 1)
+
+    pValuesCorrected = np.empty(numTests, dtype=np.float64)
+    pValuesCorrected[order] = corrected
+
+    return reject, pValuesCorrected
+
+
+def bonferroniCorrection(pValues, alpha):
+    """
+    Performs the Bonferroni family-wise error rate correction.
+
+    Equivalent to statsmodels.stats.multitest.multipletests(method='bonferroni').
+
+    Parameters
+    ----------
+    pValues : numpy.ndarray
+        The uncorrected p-values.
+    alpha : float
+        The family-wise error rate.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        A boolean array indicating which hypotheses are rejected and an array of corrected p-values.
+    """
+
+    numTests = len(pValues)
+
+    # No tests means nothing to correct (and no division by zero)
+    if numTests == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype=np.float64)
+
+    return pValues <= alpha / numTests, np.minimum(pValues * numTests, 1)
+
+
+def formatFrequencies(counts, total):
+    """
+    Formats gene counts as frequencies of the form `count/total (percentage%)`.
+
+    Parameters
+    ----------
+    counts : pandas.Series
+        The number of genes associated with each GO term.
+    total : int
+        The total number of genes in the set.
+
+    Returns
+    -------
+    pandas.Series
+        The formatted frequencies, with the percentages rounded to two decimals.
+    """
+
+    percentages = np.char.mod('%.2f', 100 * counts.to_numpy(dtype=np.float64) / total)
+
+    return counts.astype(str) + '/{0} ('.format(total) + pd.Series(percentages, index=counts.index) + '%)'
+
+
 def annotateOutput(enrichmentTestResults, GOdict, gafDict, gafSubset):
     """
     Adds the GO id names to the array with enrichment results.
 
     Parameters
     ----------
-    enrichmentTestResults : dict of dicts
-        A dictionary containing dictionaries mapping the GO IDs to their frequency counts
-        for both the interest and background set.
+    enrichmentTestResults : dict of numpy.ndarray
+        A dictionary of parallel arrays containing the GO IDs, their p-values, corrected p-values
+        and frequency counts for both the interest and background set.
     GOdict : dict
         A dictionary of GO objects generated by importOBO().
         Keys are of the format `GO-0000001` and map to OBO objects.
@@ -424,23 +1023,23 @@ def annotateOutput(enrichmentTestResults, GOdict, gafDict, gafSubset):
         A pandas DataFrame containing GO IDs, descriptions, frequency counts and p-values and corrected p-values.
     """
 
-    # Convert dictionary to dataframe with level 1 dictionary keys as columns
-    # https://stackoverflow.com/questions/37839136/convert-dictionary-of-dictionaries-into-dataframe-python
-    outputDataFrame = pd.DataFrame.from_records(enrichmentTestResults).reset_index().rename(
-        columns=dict(index='GO id', backgroundCount='background freq', interestCount='cluster freq',
-                     corr='corrected p-value', pValues='p-value'))
+    # Convert the arrays to dataframe columns
+    outputDataFrame = pd.DataFrame({'GO id': enrichmentTestResults['GOids'],
+                                    'p-value': enrichmentTestResults['pValues'],
+                                    'corrected p-value': enrichmentTestResults['corr'],
+                                    'cluster freq': enrichmentTestResults['interestCount'],
+                                    'background freq': enrichmentTestResults['backgroundCount']})
 
-    # Retrieve GO id names and namespaces
-    outputDataFrame['GO name'] = [GOdict[term].name for term in outputDataFrame['GO id']]
-    outputDataFrame['GO namespace'] = [GOdict[term].namespace for term in outputDataFrame['GO id']]
+    # Retrieve GO id names and namespaces, looking up each GO object only once
+    GOobjects = [GOdict[term] for term in outputDataFrame['GO id']]
+    outputDataFrame['GO name'] = [GOobj.name for GOobj in GOobjects]
+    outputDataFrame['GO namespace'] = [GOobj.namespace for GOobj in GOobjects]
 
     # Retrieve GO id counts in background and interest set
     backgroundTotal = len(gafDict)
     subsetTotal = len(gafSubset)
-    outputDataFrame['cluster freq'] = outputDataFrame['cluster freq'].apply(
-        lambda x: '{0}/{1} ({2}%)'.format(str(x), str(subsetTotal), "{0:.2f}".format(100 * x / subsetTotal)))
-    outputDataFrame['background freq'] = outputDataFrame['background freq'].apply(
-        lambda x: '{0}/{1} ({2}%)'.format(str(x), str(backgroundTotal), "{0:.2f}".format(100 * x / backgroundTotal)))
+    outputDataFrame['cluster freq'] = formatFrequencies(outputDataFrame['cluster freq'], subsetTotal)
+    outputDataFrame['background freq'] = formatFrequencies(outputDataFrame['background freq'], backgroundTotal)
     # https://stackoverflow.com/questions/34859135/find-key-from-value-for-pandas-series
     # outputDataFrame['background freq'] = pd.Series(['{0}/{1} ({2}%)'.format(str(outputDataFrame[outputDataFrame['GO id'] == id]['background freq']), str(backgroundTotal),
     #                                                   str(outputDataFrame[outputDataFrame['GO id'] == id]['background freq'] / backgroundTotal)) for id in outputDataFrame['GO id']])
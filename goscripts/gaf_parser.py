@@ -24,8 +24,8 @@ def importGAF(path, geneSet):
 
     Returns
     -------
-    dict of str mapping to set
-        A dictionary that maps Uniprot ACs (str) to a set GO IDs.
+    dict of str mapping to frozenset
+        A dictionary that maps Uniprot ACs (str) to a frozenset of GO IDs.
 
     Possible improvements:
         Check for `is_obsolete` and `replaced_by`, although the replacement term should be in OBO file as an entry.
@@ -53,6 +53,9 @@ def importGAF(path, geneSet):
                         else:                               # set of GO's as value
                             gafDict[uniprotAC].add(goTerm)
 
+        # Freeze the sets of GO ids, they are only used for membership tests from here on
+        gafDict = {uniprotAC: frozenset(GOids) for uniprotAC, GOids in gafDict.items()}
+
         print('Retrieved', len(gafDict),
               'annotated Uniprot AC\'s from', gafPath + '\n')
 
@@ -76,6 +79,9 @@ def importGAF(path, geneSet):
                             else:                               # set of GO terms as value
                                 gafDict[uniprotAC].add(goTerm)
 
+        # Freeze the sets of GO ids, they are only used for membership tests from here on
+        gafDict = {uniprotAC: frozenset(GOids) for uniprotAC, GOids in gafDict.items()}
+
         print('Retrieved', len(gafDict),
               'annotated (background filtered) Uniprot AC\'s from', gafPath + '\n')
 
@@ -91,14 +97,14 @@ def createSubsetGafDict(subset, gafDict):
     ----------
     subset : set of str
         A subset of Uniprot ACs of interest.
-    gafDict : dict of str mapping to set
-        A dictionary that maps Uniprot ACs (str) to a set GO IDs.
+    gafDict : dict of str mapping to frozenset
+        A dictionary that maps Uniprot ACs (str) to a frozenset of GO IDs.
         Generated by importGAF().
 
     Returns
     -------
-    dict of str mapping to set
-        A dictionary that maps the subset's Uniprot ACs to GO IDs.
+    dict of str mapping to frozenset
+        A dictionary that maps the subset's Uniprot ACs to a frozenset of GO IDs.
     """
 
     gafSubsetDict = {gene: gafDict[gene] for gene in subset if gene in gafDict}
@@ -113,8 +119,8 @@ def cleanGafTerms(gafDict, filteredGOdict):
 
     Parameters
     ----------
-    gafDict : dict of str mapping to set
-        A dictionary that maps gene Uniprot ACs (str) to a set GO term IDs.
+    gafDict : dict of str mapping to frozenset
+        A dictionary that maps gene Uniprot ACs (str) to a frozenset of GO term IDs.
         Generated by importGAF().
     filteredGOdict
         A filtered dictionary of GO objects all belonging to the same namespace.
@@ -122,7 +128,7 @@ def cleanGafTerms(gafDict, filteredGOdict):
 
     Returns
     -------
-    filteredGafDict
+    dict of str mapping to frozenset
         The gaf dictionary after removal of GO terms belonging to different namespaces.
     """
 
@@ -29,6 +29,9 @@ class goTerm:
         The parent terms of the GO term, as indicated by the `is_a` relationship.
     children : set of str
         The child terms of the GO term, derived from other GO terms after a complete OBO file is processed initially.
+    valid_terms : frozenset of str
+        The GO term itself and all of its recursive children. Computed on first use by
+        enrichment_stats.getValidTerms() and reset whenever the tree is rebuilt.
 
 
     # https://stackoverflow.com/questions/1336791/dictionary-vs-object-which-is-more-efficient-and-why
@@ -41,7 +44,7 @@ class goTerm:
     goCount = 0
 
     __slots__ = ('id', 'name', 'alt_id', 'namespace', 'children', 'parents',
-                 'recursive_children', 'recursive_parents', 'depth')
+                 'recursive_children', 'recursive_parents', 'depth', 'valid_terms')
 
     def __init__(self, GOid):
         self.id = GOid
@@ -53,6 +56,7 @@ class goTerm:
         self.recursive_children = set()
         self.recursive_parents = set()
         self.depth = None
+        self.valid_terms = None
 
         goTerm.goCount += 1
 
@@ -246,6 +250,9 @@ def buildGOtree(GOdict, root_nodes):
 
     # Process each GO term in the GO dictionary to A) recursively find parents and...
     for GOid, GOobj in GOdict.items():
+        # Invalidate the cached set of valid terms, since the child hierarchy is about to change
+        GOobj.valid_terms = None
+
         # Define new set to store higher order parents (recursed)
         parentSet = set()
         # Call helper function to propagate through parents recursively
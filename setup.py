@@ -10,4 +10,5 @@ setup(
     license='MIT',
     packages=['goscripts'],
     install_requires=['pandas', 'numpy', 'statsmodels', 'scipy'],
+    extras_require={'numba': ['numba']},
     zip_safe=False)
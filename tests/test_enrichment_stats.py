@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.stats import hypergeom
+
+from goscripts import enrichment_stats
+
+
+def test_enrichmentOneSided_matches_scipy():
+    # Random tests over the full range of k, including values outside the support
+    rng = np.random.default_rng(0)
+    for M in [1, 2, 5, 50, 300, 5000, 20000]:
+        for _ in range(10):
+            N = int(rng.integers(0, M + 1))
+            n = rng.integers(0, M + 1, size=200)
+            k = rng.integers(-2, M + 3, size=200)
+
+            pValues = enrichment_stats.enrichmentOneSided(k, M, n, N)
+            expected = hypergeom.sf(k - 1, M, n, N)
+
+            np.testing.assert_allclose(pValues, expected, rtol=1e-9, atol=1e-300)
+
+
+def test_enrichmentOneSided_wide_tails():
+    # Large draws, for which both tails span thousands of successes
+    M, N = 20000, 5000
+    n = np.array([20000, 19000, 10000, 10000, 10000, 2000, 100])
+    k = np.array([5000, 4800, 2400, 2600, 2500, 600, 0])
+
+    np.testing.assert_allclose(enrichment_stats.enrichmentOneSided(k, M, n, N),
+                               hypergeom.sf(k - 1, M, n, N), rtol=1e-9, atol=1e-300)
+
+
+def test_enrichmentOneSided_scalar_and_empty():
+    assert np.isclose(enrichment_stats.enrichmentOneSided(3, 20, 5, 4), hypergeom.sf(2, 20, 5, 4))
+    assert enrichment_stats.enrichmentOneSided(np.zeros(0, dtype=int), 10, np.zeros(0, dtype=int), 3).shape == (0,)